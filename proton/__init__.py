@@ -1,5 +1,6 @@
 from proton.printcolors import printblue, printyellow, printred, printgreen, printpurple, printbold, printunderline
 from proton.jobs import Job
 from proton.mappers import MapAsync, MapSync, StackAsync, StackerOutput
+from proton.pool import WorkerPool
 from proton.timelimiter import TimeLimiter
 from multiprocessing import Lock
\ No newline at end of file
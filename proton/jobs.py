@@ -1,11 +1,19 @@
 from multiprocessing import Process
+from threading import Thread, Event
 from typing import Union
+import queue
 from proton.messages import MessageQueue, Message
 from proton.ioqueue import InputQueue
 from proton.errors import EndingSignal, GeneratorError
 import time
 
 
+# in chunksize="auto" mode, the chunks are sized so that one chunk keeps a worker busy for about this duration (s)
+AUTO_CHUNK_DURATION = 0.05
+# upper limit for the number of jobs per chunk in chunksize="auto" mode
+AUTO_CHUNKSIZE_MAX = 1000
+
+
 class Job(object):
     args, kwargs = (), {}
 
@@ -17,20 +25,83 @@ class Job(object):
         self._process_time = None
 
 
-class JobFeeder(Process):
+class JobChunk(list):
+    """a list of jobs sent at once through the input queue,
+    unpacked by the worker on reception"""
+    pass
+
+
+class JobFeederBase(object):
+    """the job feeder logic, see JobFeeder and ThreadJobFeeder"""
+
     def __init__(
             self, job_generator, input_queue: InputQueue,
             message_queue: Union[MessageQueue, None] = None,
-            verbose: bool = False):
+            verbose: bool = False,
+            chunksize: Union[int, str] = 1,
+            job_duration=None,
+            shared_memory=None,
+            nendings: int = 1):
+        """
+        :param chunksize: number of jobs to put in the input queue at once,
+                          or "auto" to size the chunks from the processing time measured by the workers
+        :param job_duration: a shared value, the mean processing time of one job as measured by the workers,
+                             required if chunksize is "auto"
+        :param shared_memory: a SharedMemoryPool used to transmit the large arrays found in the job arguments
+        :param nendings: number of EndingSignals to put in the input queue once the generator is exhausted
+                         1 if the workers resend the EndingSignal to each other, nworkers otherwise
+        """
         super().__init__()
         self.job_generator = job_generator
         self.input_queue = input_queue
         self.message_queue = message_queue
         self.verbose = verbose
+        self.chunksize = chunksize
+        self.job_duration = job_duration
+        self.shared_memory = shared_memory
+        self.nendings = nendings
+
+        if self.chunksize == "auto":
+            if self.job_duration is None:
+                raise ValueError('job_duration is required if chunksize is "auto"')
+
+        elif not (isinstance(self.chunksize, int) and self.chunksize >= 1):
+            raise ValueError(f'chunksize must be a positive integer or "auto", got {self.chunksize}')
+
+    def current_chunksize(self):
+        """the number of jobs to pack in the next chunk"""
+        if self.chunksize != "auto":
+            return self.chunksize
+
+        job_duration = self.job_duration.value
+        if job_duration <= 0.:
+            # no measurement yet
+            return 1
+        return max(1, min(AUTO_CHUNKSIZE_MAX, int(AUTO_CHUNK_DURATION / job_duration)))
+
+    def put(self, packet):
+        self.input_queue.put(packet)
+
+    def put_chunk(self, chunk):
+        if len(chunk) == 1:
+            self.put(chunk[0])
+        else:
+            self.put(chunk)
+
+        if self.verbose:
+            for job in chunk:
+                message = Message(
+                    sender_name="job feeder",
+                    time_value=time.time(),
+                    message="put job {}".format(job._jobid),
+                    jobid=job._jobid)
+
+                self.message_queue.put(message)
 
     def run(self):
         # operates in the generator workspace
         jobid = -1
+        chunk, chunkstart = JobChunk(), time.time()
         while True:
             try:
                 gen_begin = time.time()
@@ -46,8 +117,13 @@ class JobFeeder(Process):
                 break
 
             except BaseException as e:
+                if len(chunk):
+                    # the jobs generated so far are valid
+                    self.put_chunk(chunk)
+                    chunk = JobChunk()
+
                 error = GeneratorError(str(type(e)) + " " + str(e))  # change the error class, required by the worker
-                self.input_queue.put(error)
+                self.put(error)
 
                 if self.verbose:
                     message = Message(
@@ -61,15 +137,58 @@ class JobFeeder(Process):
 
             job._jobid = jobid  # attribute the jobid now and once for all
             job._gentime = (gen_begin, gen_end)
-            self.input_queue.put(job)
+            if self.shared_memory is not None:
+                job.args = self.shared_memory.dump(job.args)
+                job.kwargs = self.shared_memory.dump(job.kwargs)
+            chunk.append(job)
 
-            if self.verbose:
-                message = Message(
-                    sender_name="job feeder",
-                    time_value=time.time(),
-                    message="put job {}".format(job._jobid),
-                    jobid=job._jobid)
+            if len(chunk) >= self.current_chunksize() or \
+                    (self.chunksize == "auto" and gen_end - chunkstart >= AUTO_CHUNK_DURATION):
+                # do not let the workers wait for a chunk that is slow to generate
+                self.put_chunk(chunk)
+                chunk, chunkstart = JobChunk(), time.time()
 
-                self.message_queue.put(message)
+        if len(chunk):
+            self.put_chunk(chunk)
+
+        for _ in range(self.nendings):
+            self.put(EndingSignal())
+
+
+class JobFeeder(JobFeederBase, Process):
+    """runs the job generator in a dedicated process"""
+    pass
+
+
+class FeederStopped(Exception):
+    pass
 
-        self.input_queue.put(EndingSignal())
+
+class ThreadJobFeeder(JobFeederBase, Thread):
+    """runs the job generator in a thread of the current process,
+    used when the job generator cannot be sent to another process (see WorkerPool)
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.daemon = True
+        self.stopped = Event()
+
+    def stop(self):
+        """interrupt the thread, even if it is waiting for the workers"""
+        self.stopped.set()
+
+    def put(self, packet):
+        while not self.stopped.is_set():
+            try:
+                self.input_queue.put(packet, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise FeederStopped
+
+    def run(self):
+        try:
+            super().run()
+        except FeederStopped:
+            pass
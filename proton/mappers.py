@@ -1,11 +1,13 @@
-from multiprocessing import Lock, cpu_count
-from proton.workers import Worker, WorkerOutput, Stacker, StackerOutput
+from multiprocessing import Lock, Value, cpu_count
+from proton.workers import Worker, WorkerOutput, WorkerOutputBatch, Stacker, StackerOutput
 from proton.errors import GeneratorError, EndingSignal, WorkerError
 from proton.messages import Message, MessageQueue, BasicPrinter
 from proton.ioqueue import InputQueue, OutputQueue
 from proton.processingtarget import ProcessingTarget
-from proton.jobs import JobFeeder, Job
+from proton.jobs import JobFeeder, ThreadJobFeeder, Job
 from proton.waitingqueue import WaitingQueue
+from proton.sharedmemory import SharedMemoryPool
+from collections import deque
 import time, random
 import os
 
@@ -26,7 +28,37 @@ class MapAsync(Mapper):
                  nworkers=None, affinity=None,
                  lock=None,
                  verbose=False,
-                 lowpriority=False):
+                 lowpriority=False,
+                 chunksize=1,
+                 batchsize=1, batch_timeout=0.1,
+                 shared_memory=None,
+                 pool=None):
+        """
+        :param chunksize: number of jobs sent at once to a worker,
+            increase it for large numbers of very short jobs to reduce the queue overhead,
+            use "auto" to adjust it from the processing time measured by the workers
+        :param batchsize: number of outputs sent at once by a worker,
+            increase it for large numbers of very short jobs to reduce the queue overhead
+        :param batch_timeout: max time (s) a worker may hold an incomplete batch of outputs
+        :param shared_memory: True or a SharedMemoryPool,
+            to transmit the large numpy arrays (job arguments and answers) through shared memory blocks,
+            the answers are then views of the shared memory, they return to the pool once deleted
+        :param pool: a WorkerPool, to run the map on its persistent workers instead of starting new ones,
+            nworkers, affinity, lock, lowpriority and shared_memory are then those of the pool
+        """
+        self.pool = pool
+        if self.pool is not None:
+            for name, value in [('nworkers', nworkers), ('affinity', affinity),
+                                ('lock', lock), ('shared_memory', shared_memory)]:
+                if value is not None:
+                    raise ValueError(f'{name} cannot be set when using a pool')
+            if lowpriority:
+                raise ValueError('lowpriority cannot be set when using a pool')
+
+            if not self.pool.started:
+                raise RuntimeError('the pool must be started first')
+            nworkers = self.pool.nworkers
+            lock = self.pool.lock
 
         self.ignore_exceptions = \
             ignore_exceptions if ignore_exceptions is not None else []
@@ -40,8 +72,49 @@ class MapAsync(Mapper):
         self.verbose = verbose
         self.lowpriority = lowpriority
         self.lock = lock
+        self.chunksize = chunksize
+        self.batchsize = batchsize
+        self.batch_timeout = batch_timeout
+        self.pending = deque()  # outputs received in a WorkerOutputBatch, not returned yet
         self.ppid = os.getpid()
 
+        # ----------- blocks of shared memory to transmit the large arrays
+        if self.pool is not None:
+            self.shared_memory = self.pool.shared_memory
+        elif shared_memory is True:
+            self.shared_memory = SharedMemoryPool(nblocks=4 * self.nworkers)
+        elif shared_memory is None or isinstance(shared_memory, SharedMemoryPool):
+            self.shared_memory = shared_memory
+        else:
+            raise TypeError(f'shared_memory must be None, True or a SharedMemoryPool, got {type(shared_memory)}')
+
+        # ----------- shared with the workers and the job feeder in chunksize="auto" mode
+        self.job_duration = Value('d', 0., lock=False) if chunksize == "auto" else None
+
+        self.target = ProcessingTarget(function_or_instance=function_or_instance)  # will be deep copied !! times self.nworkers
+        self.workers = []
+        self.nactive = self.nworkers
+        self.pids = []  # for now
+
+        if self.pool is not None:
+            # ----------- the queues, printer and workers belong to the pool
+            # the job generator runs in a thread of this process, the workers come back to the pool at the end
+            self.job_duration = self.pool.job_duration
+            self.message_queue = self.pool.message_queue
+            self.printer = self.pool.printer
+            self.input_queue = self.pool.input_queue
+            self.output_queue = self.pool.output_queue
+            self.job_feeder = ThreadJobFeeder(
+                job_generator=job_generator,
+                input_queue=self.input_queue,
+                message_queue=self.message_queue,
+                verbose=self.verbose,
+                chunksize=self.chunksize,
+                job_duration=self.job_duration,
+                shared_memory=self.shared_memory,
+                nendings=self.nworkers)
+            return
+
         # ----------- message queue and message printer thread
         # needed even in non-verbose mode (for worker.communicate)
         self.message_queue = MessageQueue(maxsize=1000)
@@ -53,29 +126,24 @@ class MapAsync(Mapper):
         # do not increase maxsize, there is always a better explanation
         # if the code is slow
 
-        # -----------
-        self.pids = []  # for now
-
         # -----------
         self.job_feeder = JobFeeder(
             job_generator=job_generator,
             input_queue=self.input_queue,
             message_queue=self.message_queue,
-            verbose=self.verbose)
+            verbose=self.verbose,
+            chunksize=self.chunksize,
+            job_duration=self.job_duration,
+            shared_memory=self.shared_memory)
 
         # ----------- determine if each worker will have a distinct target or not
-        self.workers = []
-        self.nactive = self.nworkers
-
         seedstmp = [random.random() * 100000
                     for _ in range(self.nworkers)]
 
-        target = ProcessingTarget(function_or_instance=function_or_instance)  # will be deep copied !! times self.nworkers
-
         for i in range(self.nworkers):
 
             worker = self.whichworker(
-                target=target,
+                target=self.target,
                 inputqueue=self.input_queue,
                 outputqueue=self.output_queue,
                 messagequeue=self.message_queue,
@@ -83,7 +151,11 @@ class MapAsync(Mapper):
                 seed=seedstmp[i],  # in case two mapasync run at the same time
                 parent=self,
                 lock=self.lock,
-                verbose=self.verbose)
+                verbose=self.verbose,
+                job_duration=self.job_duration,
+                batchsize=self.batchsize,
+                batch_timeout=self.batch_timeout,
+                shared_memory=self.shared_memory)
             worker.name = "Worker_{:04d}".format(i + 1)
             self.workers.append(worker)
 
@@ -93,7 +165,7 @@ class MapAsync(Mapper):
             "    Generator pid = {generator_pid}\n" \
             "    Printer pid = {printer_pid}\n".format(
             ppid=self.ppid,
-            generator_pid=self.job_feeder.pid,
+            generator_pid=self.job_feeder.pid if self.pool is None else self.ppid,
             printer_pid=self.printer.pid if self.printer is not None else -1)
 
         for worker in self.workers:
@@ -101,6 +173,10 @@ class MapAsync(Mapper):
         return s
 
     def __enter__(self):
+        if self.pool is not None:
+            self.workers = self.pool.start_map(self)
+            self.job_feeder.start()
+            return self
 
         for worker in self.workers:
             worker.start()
@@ -122,6 +198,13 @@ class MapAsync(Mapper):
         # case 1 : no error, all outputs have been extracted from Out => join the workers
         # case 2 : no error, not all outputs extracted from Out => terminate
         # case 3 : some errors => terminate
+        if self.pool is not None:
+            self.job_feeder.stop()
+            self.job_feeder.join()
+            # the pool restarts its workers if they did not all reach the end of this map
+            self.pool.end_map(self, success=exc_type is None and self.nactive == 0)
+            return
+
         if exc_type is None and self.nactive == 0:
 
             for worker in self.workers:
@@ -149,6 +232,10 @@ class MapAsync(Mapper):
             if self.printer is not None:
                 self.printer.terminate()
 
+        if self.shared_memory is not None:
+            # the answers already returned remain valid
+            self.shared_memory.close()
+
     def affinity_to_taskset_command(self):
         if "-" in self.affinity:
 
@@ -187,8 +274,34 @@ class MapAsync(Mapper):
         return self
 
     def __next__(self):
-        if not self.nactive:
+        if not self.fill():
             raise StopIteration
+        return self.pending.popleft()
+
+    def get_many(self):
+        """return all the outputs already received as a list (at least one),
+        or an empty list once all the outputs have been returned
+        """
+        if not self.fill():
+            return []
+        worker_outputs = list(self.pending)
+        self.pending.clear()
+        return worker_outputs
+
+    def load_answer(self, worker_output):
+        if self.shared_memory is not None:
+            worker_output.answer = self.shared_memory.load(worker_output.answer)
+        return worker_output
+
+    def fill(self):
+        """make sure that self.pending holds at least one output,
+        return False if all the outputs have been returned
+        """
+        if len(self.pending):
+            return True
+
+        if not self.nactive:
+            return False
 
         while self.nactive:
             packet = self.output_queue.get()
@@ -215,8 +328,14 @@ class MapAsync(Mapper):
                 # non fatal
                 continue
 
+            elif isinstance(packet, WorkerOutputBatch):
+                for worker_output in packet:
+                    self.pending.append(self.load_answer(worker_output))
+                return True
+
             elif isinstance(packet, WorkerOutput):
-                return packet
+                self.pending.append(self.load_answer(packet))
+                return True
 
             else:
                 raise TypeError(type(packet))
@@ -229,11 +348,12 @@ class MapAsync(Mapper):
                 jobid=None)
             self.message_queue.put(message)
 
-        if self.message_queue is not None:
+        if self.message_queue is not None and self.pool is None:
             # not related to verbose mode
+            # (the printer of a pool lives until the pool is closed)
             self.message_queue.put(EndingSignal())
 
-        raise StopIteration
+        return False
 
 
 class MapSync(MapAsync):
@@ -244,6 +364,9 @@ class MapSync(MapAsync):
 
         super(MapSync, self).__init__(*args, **kwargs)
 
+    def get_many(self):
+        raise NotImplementedError("get_many does not preserve the order, iterate over MapSync instead")
+
     def __iter__(self):
         # jobs that come up too soon are kept in a waiting queue to preserve the input order
         return WaitingQueue(self, verbose=self.verbose, message_queue=self.message_queue)
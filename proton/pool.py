@@ -0,0 +1,210 @@
+from multiprocessing import Value, cpu_count
+from proton.workers import Worker, MapStart
+from proton.errors import EndingSignal
+from proton.messages import MessageQueue, BasicPrinter
+from proton.ioqueue import BasicQueue, InputQueue, OutputQueue
+from proton.sharedmemory import SharedMemoryPool
+import random
+
+
+class WorkerPool(object):
+    """
+    a set of persistent workers kept alive across successive maps,
+    to avoid starting new processes (and re-importing modules) for each map
+
+    usage :
+
+    with WorkerPool(nworkers=4) as pool:
+        with MapAsync(function_or_instance=fun1, job_generator=job_generator1(), pool=pool) as ma:
+            for worker_output in ma:
+                ...
+
+        with MapSync(function_or_instance=fun2, job_generator=job_generator2(), pool=pool) as ma:
+            for worker_output in ma:
+                ...
+
+    the target of each map is sent to the workers through a queue, it must be picklable
+    (i.e. a function or a class defined at the module level)
+    the job generator runs in a thread of the parent process
+    only one map can use the pool at a time
+    """
+
+    def __init__(self, nworkers=None, lock=None, shared_memory=None):
+        """
+        :param nworkers: number of workers in the pool
+        :param lock: a multiprocessing Lock shared by the workers
+        :param shared_memory: True or a SharedMemoryPool, see MapAsync
+        """
+        self.nworkers = nworkers if nworkers is not None else cpu_count()
+        self.lock = lock
+        self.shared_memory_option = shared_memory
+
+        # shared with the workers and the job feeders in chunksize="auto" mode
+        self.job_duration = Value('d', 0., lock=False)
+
+        self.message_queue = None
+        self.printer = None
+        self.input_queue = None
+        self.output_queue = None
+        self.shared_memory = None
+        self.groups = {}  # the persistent workers, by worker class (Worker, Stacker, ...)
+        self.mapper = None  # the mapper using the pool
+        self.started = False
+
+    def __str__(self):
+        s = "----------------------------\n" \
+            "{} ({} workers)\n" \
+            "    Printer pid = {}\n".format(
+                self.__class__.__name__, self.nworkers,
+                self.printer.pid if self.printer is not None else -1)
+
+        for workers in self.groups.values():
+            for worker in workers:
+                s += "    {}  pid = {}; seed = {}\n".format(worker.name, worker.pid, worker.seed)
+        return s
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None and self.mapper is None:
+            self.close()
+        else:
+            self.terminate()
+
+    def start(self):
+        """create the queues and start the printer and the workers"""
+        if self.started:
+            return
+
+        self.message_queue = MessageQueue(maxsize=1000)
+        self.printer = BasicPrinter(self.message_queue)
+
+        self.input_queue = InputQueue(maxsize=self.nworkers)
+        self.output_queue = OutputQueue(maxsize=self.nworkers)
+
+        if self.shared_memory_option is True:
+            self.shared_memory = SharedMemoryPool(nblocks=4 * self.nworkers)
+        elif self.shared_memory_option is None or isinstance(self.shared_memory_option, SharedMemoryPool):
+            self.shared_memory = self.shared_memory_option
+        else:
+            raise TypeError(f'shared_memory must be None, True or a SharedMemoryPool, '
+                            f'got {type(self.shared_memory_option)}')
+
+        self.printer.start()
+        self.started = True
+
+        # the most common case, other kind of workers (e.g. Stackers) are started on demand
+        self.workers(Worker)
+
+    def workers(self, whichworker):
+        """get the persistent workers of a given class, start them if needed"""
+        if not self.started:
+            raise RuntimeError(f'the {self.__class__.__name__} is not started')
+
+        try:
+            return self.groups[whichworker]
+        except KeyError:
+            pass
+
+        workers = []
+        for i in range(self.nworkers):
+            worker = whichworker(
+                target=None,  # see MapStart
+                inputqueue=self.input_queue,
+                outputqueue=self.output_queue,
+                messagequeue=self.message_queue,
+                seed=random.random() * 100000,
+                parent=self,
+                lock=self.lock,
+                job_duration=self.job_duration,
+                shared_memory=self.shared_memory,
+                control_queue=BasicQueue())
+            worker.name = "{}_{:04d}".format(whichworker.__name__, i + 1)
+            worker.start()
+            workers.append(worker)
+
+        self.groups[whichworker] = workers
+        return workers
+
+    def start_map(self, mapper):
+        """called by the mapper when entering its context,
+        send the map target to the workers and return them
+        """
+        if self.mapper is not None:
+            raise RuntimeError(f'the {self.__class__.__name__} is already used by another mapper')
+
+        workers = self.workers(mapper.whichworker)
+        self.mapper = mapper
+
+        order = MapStart(
+            target=mapper.target,
+            ignore_exceptions=mapper.ignore_exceptions,
+            verbose=mapper.verbose,
+            batchsize=mapper.batchsize,
+            batch_timeout=mapper.batch_timeout)
+
+        for worker in workers:
+            worker.control_queue.put(order)
+        return workers
+
+    def end_map(self, mapper, success):
+        """called by the mapper when leaving its context
+        :param success: True if all the workers have reached the end of the map,
+                        otherwise the workers and queues are in an unknown state and must be restarted
+        """
+        if mapper is not self.mapper:
+            raise RuntimeError(f'this mapper is not using the {self.__class__.__name__}')
+        self.mapper = None
+
+        if not success:
+            self.terminate()
+            self.start()
+
+    def close(self):
+        """stop the workers once they are idle"""
+        if not self.started:
+            return
+
+        for workers in self.groups.values():
+            for worker in workers:
+                worker.control_queue.put(EndingSignal())
+
+        for workers in self.groups.values():
+            for worker in workers:
+                worker.join()
+                worker.control_queue.close()
+
+        self.message_queue.put(EndingSignal())
+        self.printer.join()
+
+        self.input_queue.close()
+        self.output_queue.close()
+        self.message_queue.close()
+        self.release()
+
+    def terminate(self):
+        """kill the workers, whatever they are doing"""
+        if not self.started:
+            return
+
+        self.input_queue.close()
+        self.output_queue.close()
+        self.message_queue.close()
+
+        for workers in self.groups.values():
+            for worker in workers:
+                worker.terminate()
+                worker.control_queue.close()
+        self.printer.terminate()
+        self.release()
+
+    def release(self):
+        if self.shared_memory is not None and self.shared_memory is not self.shared_memory_option:
+            # created by the pool
+            self.shared_memory.close()
+
+        self.groups = {}
+        self.shared_memory = None
+        self.started = False
@@ -0,0 +1,177 @@
+import queue
+import weakref
+from collections import deque
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from proton.ioqueue import BasicQueue
+
+"""
+transport large numpy arrays through shared memory blocks
+instead of pickling them through the pipes of the queues
+"""
+
+
+class SharedArray(object):
+    """a light handle sent through the queues in place of an array
+    stored in a block of a SharedMemoryPool"""
+
+    def __init__(self, name, shape, dtype):
+        self.name = name  # name of the shared memory block
+        self.shape = shape
+        self.dtype = dtype
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.name}, shape={self.shape}, dtype={self.dtype})"
+
+
+class SharedMemoryPool(object):
+    """a fixed set of shared memory blocks created by the mapper,
+    reused by all the processes to transmit large arrays (job arguments and answers)
+
+    the sender copies the array in a free block and puts a SharedArray handle in the queue,
+    the receiver gets a view of the block (no copy),
+    the block returns to the pool once the receiver has deleted all references to that view
+    when no block is available (or the array does not fit), the array is pickled as usual
+    """
+
+    def __init__(self, nblocks: int, blocksize: int = 2 ** 26, threshold: int = 2 ** 20):
+        """
+        :param nblocks: number of blocks in the pool
+        :param blocksize: size of each block in bytes, larger arrays are pickled as usual
+        :param threshold: arrays smaller than this (in bytes) are pickled as usual
+        """
+        if not nblocks >= 1:
+            raise ValueError(f'nblocks must be >= 1, got {nblocks}')
+        if not blocksize >= threshold:
+            raise ValueError('blocksize must be >= threshold')
+
+        self.blocksize = blocksize
+        self.threshold = threshold
+        self.closed = False
+
+        self.names = []
+        self.blocks = {}  # the blocks attached in the current process, by name
+        self.free_blocks = BasicQueue()  # names of the blocks available to any process
+
+        for _ in range(nblocks):
+            block = SharedMemory(create=True, size=blocksize)
+            self.names.append(block.name)
+            self.blocks[block.name] = block
+            self.free_blocks.put(block.name)
+
+        # names of the blocks viewed by the current process
+        # (numpy does not lock the buffer, the block must not be closed while a view exists)
+        self.viewed = set()
+
+        # names of the blocks released by the current process, not returned to free_blocks yet
+        # (the finalizers must not touch the queue directly)
+        self.released = deque()
+
+    def __len__(self):
+        return len(self.names)
+
+    def attach(self, name):
+        try:
+            return self.blocks[name]
+        except KeyError:
+            block = self.blocks[name] = SharedMemory(name=name, create=False)
+            return block
+
+    def release(self, name):
+        """called when the last reference to a view of the block disappears"""
+        self.viewed.discard(name)
+        if self.closed:
+            # the pool was closed while the block was in use
+            block = self.blocks.pop(name, None)
+            if block is not None:
+                block.close()
+        else:
+            self.released.append(name)
+
+    def recycle(self):
+        """return the released blocks to the pool"""
+        while len(self.released):
+            self.free_blocks.put(self.released.popleft())
+
+    def dump(self, obj):
+        """replace the large arrays found in obj by SharedArray handles
+        obj may be an array, or a tuple, list or dict of objects
+        """
+        self.recycle()
+
+        if isinstance(obj, np.ndarray):
+            return self.dump_array(obj)
+
+        elif type(obj) is tuple:
+            return tuple([self.dump(item) for item in obj])
+
+        elif type(obj) is list:
+            return [self.dump(item) for item in obj]
+
+        elif type(obj) is dict:
+            return {key: self.dump(value) for key, value in obj.items()}
+
+        return obj
+
+    def dump_array(self, array):
+        if not self.threshold <= array.nbytes <= self.blocksize or array.dtype.hasobject:
+            return array
+
+        try:
+            name = self.free_blocks.get(block=False)
+        except queue.Empty:
+            # all the blocks are in use, pickle the array
+            return array
+
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=self.attach(name).buf)
+        view[...] = array
+        del view  # release the buffer
+
+        return SharedArray(name=name, shape=array.shape, dtype=array.dtype)
+
+    def load(self, obj):
+        """replace the SharedArray handles found in obj by views of the shared memory blocks"""
+        self.recycle()
+
+        if isinstance(obj, SharedArray):
+            return self.load_array(obj)
+
+        elif type(obj) is tuple:
+            return tuple([self.load(item) for item in obj])
+
+        elif type(obj) is list:
+            return [self.load(item) for item in obj]
+
+        elif type(obj) is dict:
+            return {key: self.load(value) for key, value in obj.items()}
+
+        return obj
+
+    def load_array(self, shared_array):
+        view = np.ndarray(
+            shared_array.shape, dtype=shared_array.dtype,
+            buffer=self.attach(shared_array.name).buf)
+
+        # the block returns to the pool when the view is garbage collected
+        self.viewed.add(shared_array.name)
+        finalizer = weakref.finalize(view, self.release, shared_array.name)
+        finalizer.atexit = False
+        return view
+
+    def close(self):
+        """called by the process that created the pool, once all the other processes are done"""
+        if self.closed:
+            return
+        self.closed = True
+
+        for name in self.names:
+            block = self.attach(name)
+            block.unlink()
+            if name in self.viewed:
+                # a view of this block is still in use in this process,
+                # it will be closed by self.release
+                continue
+            block.close()
+            del self.blocks[name]
+
+        self.free_blocks.close()
@@ -1,8 +1,24 @@
-from proton import Job, MapAsync, MapSync, StackAsync, StackerOutput
+from proton import Job, MapAsync, MapSync, StackAsync, StackerOutput, WorkerPool
 import time
+import os
 import numpy as np
 
 
+# targets sent to the workers through the queues must be defined at the module level
+def square(i):
+    return i ** 2
+
+
+def getpid(i):
+    return os.getpid()
+
+
+def failing(i):
+    if i == 5:
+        raise ValueError('i must not be 5')
+    return i
+
+
 def test_mapasync_basic_workflow():
 
     def job_generator():
@@ -99,3 +115,139 @@ def test_stacker():
 
     assert ans.answer == values.sum()
     assert len(ans.jobids) == len(values)
+
+
+def test_chunksize():
+
+    def job_generator():
+        for i in range(1000):
+            yield Job(i)
+
+    def fun(i):
+        return 2 * i
+
+    for chunksize in [7, "auto"]:
+        with MapAsync(function_or_instance=fun,
+                      job_generator=job_generator(),
+                      nworkers=4,
+                      chunksize=chunksize) as ma:
+            jobids = []
+            for worker_output in ma:
+                assert worker_output.answer == 2 * worker_output.jobid
+                assert worker_output.elapsed_generator_time() >= 0.
+                assert worker_output.elapsed_processor_time() >= 0.
+                jobids.append(worker_output.jobid)
+
+        assert sorted(jobids) == list(range(1000))
+
+    with MapSync(function_or_instance=fun,
+                 job_generator=job_generator(),
+                 nworkers=4,
+                 chunksize="auto") as ma:
+        jobids = [worker_output.jobid for worker_output in ma]
+    assert jobids == list(range(1000))
+
+
+def test_batchsize():
+
+    def job_generator():
+        for i in range(1000):
+            yield Job(i)
+
+    def fun(i):
+        return 2 * i
+
+    with MapAsync(function_or_instance=fun,
+                  job_generator=job_generator(),
+                  nworkers=4,
+                  chunksize=10,
+                  batchsize=16) as ma:
+        jobids = [worker_output.jobid for worker_output in ma]
+    assert sorted(jobids) == list(range(1000))
+
+    with MapAsync(function_or_instance=fun,
+                  job_generator=job_generator(),
+                  nworkers=4,
+                  batchsize=16) as ma:
+        jobids = []
+        while True:
+            worker_outputs = ma.get_many()
+            if not len(worker_outputs):
+                break
+            for worker_output in worker_outputs:
+                assert worker_output.answer == 2 * worker_output.jobid
+                jobids.append(worker_output.jobid)
+    assert sorted(jobids) == list(range(1000))
+
+    with MapSync(function_or_instance=fun,
+                 job_generator=job_generator(),
+                 nworkers=4,
+                 batchsize=16) as ma:
+        jobids = [worker_output.jobid for worker_output in ma]
+    assert jobids == list(range(1000))
+
+
+def test_shared_memory():
+
+    def job_generator():
+        for i in range(20):
+            yield Job(np.full(300000, float(i)), scale=2.)
+
+    def fun(array, scale):
+        return array * scale, array.sum()
+
+    with MapAsync(function_or_instance=fun,
+                  job_generator=job_generator(),
+                  nworkers=2,
+                  shared_memory=True) as ma:
+        for worker_output in ma:
+            array, total = worker_output.answer
+            i = worker_output.jobid
+            assert array.shape == (300000,)
+            assert np.all(array == 2. * i)
+            assert total == 300000 * i
+            del array
+
+
+def test_worker_pool():
+
+    def job_generator():
+        for i in range(20):
+            yield Job(i)
+
+    with WorkerPool(nworkers=2) as pool:
+        with MapAsync(function_or_instance=getpid,
+                      job_generator=job_generator(),
+                      pool=pool) as ma:
+            pids = set(worker_output.answer for worker_output in ma)
+
+        for _ in range(3):
+            # another target on the same workers
+            with MapSync(function_or_instance=square,
+                         job_generator=job_generator(),
+                         pool=pool) as ma:
+                answers = [worker_output.answer for worker_output in ma]
+            assert answers == [i ** 2 for i in range(20)]
+
+        with MapAsync(function_or_instance=getpid,
+                      job_generator=job_generator(),
+                      pool=pool) as ma:
+            assert set(worker_output.answer for worker_output in ma) <= \
+                   set(worker.pid for worker in ma.workers)
+        assert pids <= set(worker.pid for worker in ma.workers)
+
+        # a fatal error restarts the pool
+        try:
+            with MapAsync(function_or_instance=failing,
+                          job_generator=job_generator(),
+                          pool=pool) as ma:
+                list(ma)
+        except Exception as e:
+            assert "i must not be 5" in str(e)
+        else:
+            raise AssertionError('the error was not raised')
+
+        with StackAsync(function_or_instance=square,
+                        job_generator=job_generator(),
+                        pool=pool) as sa:
+            assert sa.stack().answer == sum([i ** 2 for i in range(20)])
@@ -2,8 +2,10 @@ import random
 import time
 import traceback
 import sys
+import queue
+from collections import deque
 from multiprocessing import Process
-from proton.jobs import Job
+from proton.jobs import Job, JobChunk
 from proton.messages import Message, MessageQueue
 from proton.processingtarget import ProcessingTarget
 from proton.errors import EndingSignal, GeneratorError, WorkerError
@@ -48,10 +50,32 @@ class WorkerOutput(object):
                f"answer:{ans_cut}"
 
 
+class WorkerOutputBatch(list):
+    """a list of WorkerOutputs sent at once through the output queue,
+    unpacked by the mapper on reception"""
+    pass
+
+
+class MapStart(object):
+    """the order sent to a persistent worker to start serving a new map, see WorkerPool"""
+
+    def __init__(self, target, ignore_exceptions=None, verbose=False,
+                 batchsize=1, batch_timeout=0.1):
+        self.target = target
+        self.ignore_exceptions = ignore_exceptions if ignore_exceptions is not None else []
+        self.verbose = verbose
+        self.batchsize = batchsize
+        self.batch_timeout = batch_timeout
+
+
 class Worker(Process):
     def __init__(self, target, inputqueue, outputqueue, messagequeue,
                  ignore_exceptions=None, seed=None,
-                 parent=None, lock=None, verbose:bool = False):
+                 parent=None, lock=None, verbose:bool = False,
+                 job_duration=None,
+                 batchsize: int = 1, batch_timeout: float = 0.1,
+                 shared_memory=None,
+                 control_queue=None):
         """
         :param target: a Target object, the function or object to call inside the dedicated workspaces
         :param inputqueue: a InputQueue object, the queue that transmit jobs from the main workspace inside the dedicated workspaces
@@ -61,6 +85,13 @@ class Worker(Process):
         :param seed:
         :param parent: the parent object, may be MapAsync, MapSync, StackAsync, ...
         :param lock:
+        :param job_duration: a shared value, used to report the mean processing time of one job to the JobFeeder
+                             (for chunksize="auto")
+        :param batchsize: number of WorkerOutputs to group in one WorkerOutputBatch before sending it to the mapper
+        :param batch_timeout: send an incomplete batch if its oldest output has been waiting for longer than this (s)
+        :param shared_memory: a SharedMemoryPool used to transmit the large arrays (job arguments and answers)
+        :param control_queue: for persistent workers only (see WorkerPool),
+                              the queue through which the worker receives the MapStart orders
         """
         Process.__init__(self)
         self.inputqueue = inputqueue
@@ -78,6 +109,19 @@ class Worker(Process):
         self.parent = parent
         self.is_locked = False
         self.lock = lock
+        self.job_duration = job_duration
+        self.chunk = deque()  # jobs received in a JobChunk, not processed yet
+
+        if not (isinstance(batchsize, int) and batchsize >= 1):
+            raise ValueError(f'batchsize must be a positive integer, got {batchsize}')
+        self.batchsize = batchsize
+        self.batch_timeout = batch_timeout
+        self.batch = WorkerOutputBatch()  # outputs not sent yet
+        self.batch_start = None  # time at which the oldest output of the batch was added
+        self.shared_memory = shared_memory
+        self.control_queue = control_queue
+        # a persistent worker does not resend the EndingSignal to the others, it goes back to the control queue
+        self.recirculate = control_queue is None
 
         # ------ attach random functions to the worker
         if self.seed is None:
@@ -121,7 +165,104 @@ class Worker(Process):
             jobid=None)
         self.messagequeue.put(message)
 
+    def get_packet(self):
+        """get the next packet from the input queue,
+           the chunks of jobs are unpacked here and returned one job at a time
+        """
+        if len(self.chunk):
+            return self.chunk.popleft()
+
+        if len(self.batch):
+            try:
+                packet = self.inputqueue.get(block=False)
+            except queue.Empty:
+                # never keep outputs while waiting for more jobs
+                self.flush_outputs()
+                packet = self.inputqueue.get()
+        else:
+            packet = self.inputqueue.get()
+
+        if isinstance(packet, JobChunk):
+            self.chunk.extend(packet)
+            return self.chunk.popleft()
+        return packet
+
+    def call_target(self, job):
+        """run the target on the arguments of job"""
+        args, kwargs = job.args, job.kwargs
+        if self.shared_memory is not None:
+            args = self.shared_memory.load(args)
+            kwargs = self.shared_memory.load(kwargs)
+
+        if self.target.passworker:
+            # pass self (i.e. the worker to self.target as first argument)
+            return self.target(self, *args, **kwargs)
+
+        # call the target function here!!!
+        return self.target(*args, **kwargs)
+
+    def dump_answer(self, answer):
+        if self.shared_memory is not None:
+            return self.shared_memory.dump(answer)
+        return answer
+
+    def put_output(self, output):
+        """send one WorkerOutput to the mapper, or add it to the current batch"""
+        if self.batchsize == 1:
+            self.outputqueue.put(output)
+            return
+
+        if not len(self.batch):
+            self.batch_start = time.time()
+        self.batch.append(output)
+
+        if len(self.batch) >= self.batchsize or \
+                time.time() - self.batch_start >= self.batch_timeout:
+            self.flush_outputs()
+
+    def flush_outputs(self):
+        """send the current batch of outputs if any"""
+        if len(self.batch):
+            self.outputqueue.put(self.batch)
+            self.batch = WorkerOutputBatch()
+            self.batch_start = None
+
+    def report_job_duration(self, jobtime):
+        """update the mean processing time shared with the JobFeeder"""
+        if self.job_duration is None:
+            return
+
+        duration = jobtime[1] - jobtime[0]
+        if self.job_duration.value <= 0.:
+            self.job_duration.value = duration
+        else:
+            self.job_duration.value = 0.9 * self.job_duration.value + 0.1 * duration
+
+    def configure(self, order: MapStart):
+        """prepare a persistent worker for a new map"""
+        self.target = order.target
+        self.ignore_exceptions = order.ignore_exceptions
+        self.verbose = order.verbose
+        self.batchsize = order.batchsize
+        self.batch_timeout = order.batch_timeout
+
     def run(self):
+        if self.control_queue is None:
+            self.serve()
+            return
+
+        # persistent worker, serve one map after the other
+        while True:
+            order = self.control_queue.get()
+            if isinstance(order, EndingSignal):
+                return
+            elif not isinstance(order, MapStart):
+                raise TypeError('got object of type {} out of the control queue'.format(str(type(order))))
+
+            self.configure(order)
+            self.serve()
+
+    def serve(self):
         """gets jobs from the inputqueue and runs it until
            it gets the ending signal
         """
@@ -132,7 +273,7 @@ class Worker(Process):
         # -----
 
         while True:
-            packet = self.inputqueue.get()
+            packet = self.get_packet()
             if isinstance(packet, EndingSignal):  # got the ending signal
                 if self.verbose:
                     message = Message(
@@ -142,11 +283,14 @@ class Worker(Process):
                         jobid=None)
                     self.messagequeue.put(message)
 
-                self.inputqueue.put(packet)  # resend the ending signal for the other workers
+                self.flush_outputs()
+                if self.recirculate:
+                    self.inputqueue.put(packet)  # resend the ending signal for the other workers
                 self.outputqueue.put(packet)  # ending signal
                 return
 
             elif isinstance(packet, GeneratorError):  # the generator has failed
+                self.flush_outputs()
                 self.inputqueue.put(EndingSignal())  # send the ending signal to the other workers
                 self.outputqueue.put(packet)  # transmit the GeneratorError
                 return
@@ -167,18 +311,9 @@ class Worker(Process):
 
             try:
                 start = time.time()
-
-                if self.target.passworker:
-                    # pass self (i.e. the worker to self.target as first argument)
-                    answer = self.target(
-                        self, *job.args, **job.kwargs)
-
-                else:
-                    # call the target function here!!!
-                    answer = self.target(
-                        *job.args, **job.kwargs)
-
+                answer = self.call_target(job)
                 jobtime = (start, time.time())
+                self.report_job_duration(jobtime)
 
             except Exception:
                 nfail += 1
@@ -192,6 +327,7 @@ class Worker(Process):
                     errtype=errtype,
                     errvalue=errvalue)
 
+                self.flush_outputs()  # preserve the order of the outputs
                 self.outputqueue.put(output)
 
                 if errtype not in self.ignore_exceptions:
@@ -209,11 +345,11 @@ class Worker(Process):
 
             ouptut = WorkerOutput(
                 jobid=job._jobid,
-                answer=answer,
+                answer=self.dump_answer(answer),
                 generator_time=job._gentime,
                 processor_time=jobtime)
 
-            self.outputqueue.put(ouptut)
+            self.put_output(ouptut)
             nput += 1  # count only jobs, not signals or errors
 
             if self.verbose:
@@ -275,7 +411,7 @@ class Stacker(Worker):
     see tutorials
     """
 
-    def run(self):
+    def serve(self):
         """gets jobs from the inputqueue and runs it until
            it gets the ending signal
         """
@@ -287,7 +423,7 @@ class Stacker(Worker):
         Tpro = 0.  # cumulative processing time
 
         while True:
-            packet = self.inputqueue.get()
+            packet = self.get_packet()
 
             if isinstance(packet, EndingSignal):
                 # got the ending signal
@@ -305,13 +441,14 @@ class Stacker(Worker):
                     ouptut = StackerOutput(
                         stacker_name=self.name,
                         jobids=jobids,
-                        answer=stackanswer,
+                        answer=self.dump_answer(stackanswer),
                         generator_time=Tgen,
                         processor_time=Tpro)
 
                     self.outputqueue.put(ouptut)
 
-                self.inputqueue.put(packet)  # resend the ending signal for the other workers
+                if self.recirculate:
+                    self.inputqueue.put(packet)  # resend the ending signal for the other workers
                 self.outputqueue.put(packet)  # ending signal
                 return
 
@@ -320,7 +457,7 @@ class Stacker(Worker):
                     ouptut = StackerOutput(
                         stacker_name=self.name,
                         jobids=jobids,
-                        answer=stackanswer,
+                        answer=self.dump_answer(stackanswer),
                         generator_time=Tgen,
                         processor_time=Tpro)
 
@@ -346,15 +483,7 @@ class Stacker(Worker):
 
             try:
                 start = time.time()
-
-                if self.target.passworker:
-                    # pass self (i.e. the worker to self.target as first argument)
-                    answer = self.target(
-                        self, *job.args, **job.kwargs)
-                else:
-                    # call the target function here!!!
-                    answer = self.target(
-                        *job.args, **job.kwargs)
+                answer = self.call_target(job)
 
                 # assert hasattr(answer, "__iadd__")
                 if stackanswer is None:
@@ -363,6 +492,7 @@ class Stacker(Worker):
                     stackanswer += answer
 
                 jobtime = (start, time.time())
+                self.report_job_duration(jobtime)
 
                 Tgen += job._gentime[1] - job._gentime[0]  # cumulate the generation time
                 Tpro += jobtime[1] - jobtime[0]  # cumulate the processing time